@@ -1,70 +1,152 @@
+import hashlib
+import io
+import json
+import logging
+import os
 import re
-from typing import Optional, List, Tuple
-
+import stat
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional, Dict, List, Tuple
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import gspread
 from google.oauth2.service_account import Credentials
 
 st.set_page_config(page_title="Counterparty / Charterer Search", layout="wide")
 
+logger = logging.getLogger(__name__)
+
 SPREADSHEET_ID = st.secrets["app"]["spreadsheet_id"]
 WORKSHEET_NAME = st.secrets["app"].get("worksheet_name", "Sheet1")
+# Private directory for the local Parquet snapshots (created 0700 if missing)
+CACHE_DIR = st.secrets["app"].get(
+    "cache_dir",
+    os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "counterpartysearch"),
+)
 
 STATUS_OPTIONS = ["Approved", "Pending", "Rejected"]
 
+# Fields stored as pandas categoricals when their values repeat enough
+CATEGORICAL_FIELDS = ["status", "sp", "moodys", "infospec", "dynamar"]
+
+# Logical field -> candidate header names (exact match first, then substring)
+COLUMN_CANDIDATES = {
+    "status":    ["Status"],
+    "charterer": ["Charterer"],
+    "company":   ["Company"],
+    "owner":     ["Parent Company/Ownership", "Ownership", "Parent Company"],
+    "address":   ["Address"],
+    # Detail-only fields
+    "pool":      ["Pool Agreement"],
+    "sp":        ["S&P", "S&P Rating", "S&P rating"],
+    "moodys":    ["Moody", "Moody's", "Moody's Rating"],
+    "infospec":  ["InfoSpectrum", "Info Spectrum", "Infospectrum Rating"],
+    "dynamar":   ["Dynamar", "Dynamar Rating"],
+    "sanctions": ["Sanctions Check", "Sanction Check", "Sanctions"],
+    "comments":  ["Comment", "Comments"],
+}
+
+_WS_RE = re.compile(r"[ \t]+")
+
+# Sheet status synonyms (upper-cased) -> one of STATUS_OPTIONS, and -> badge markdown
+_STATUS_SYNONYMS = {
+    **dict.fromkeys(["APPROVED", "APPROVE", "A"], "Approved"),
+    **dict.fromkeys(["PENDING", "IN REVIEW", "REVIEW"], "Pending"),
+    **dict.fromkeys(["REJECTED", "REJECT", "DECLINED"], "Rejected"),
+}
+_STATUS_BADGES = {"Approved": "✅ **APPROVED**", "Pending": "🟡 **PENDING**", "Rejected": "⛔ **REJECTED**"}
+_STATUS_MAP = {k: _STATUS_BADGES[v] for k, v in _STATUS_SYNONYMS.items()}
+
 # -----------------------------
 # Helpers
 # -----------------------------
 def _clean_cell(x: object) -> str:
-    s = "" if x is None else str(x)
-    s = re.sub(r"[ \t]+", " ", s).strip()
-    return s
-
-def _find_col(df: pd.DataFrame, candidates: List[str]) -> Optional[str]:
-    cols = list(df.columns)
-    lowered = {c.lower(): c for c in cols}
-    for cand in candidates:
-        cand_l = cand.lower()
+    return _WS_RE.sub(" ", "" if x is None else str(x)).strip()
+
+@lru_cache(maxsize=None)
+def _col_index(cols: Tuple[str, ...]) -> Tuple[Dict[str, str], List[Tuple[str, str]]]:
+    """Lowercased column names, computed once per header set: exact map + ordered pairs."""
+    pairs = [(c.lower(), c) for c in cols]
+    return dict(pairs), pairs
+
+@lru_cache(maxsize=None)
+def _find_col_cached(cols: Tuple[str, ...], candidates: Tuple[str, ...]) -> Optional[str]:
+    lowered, pairs = _col_index(cols)
+    cands = [cand.lower() for cand in candidates]
+    for cand_l in cands:
         if cand_l in lowered:
             return lowered[cand_l]
-    for c in cols:
-        c_l = c.lower()
-        for cand in candidates:
-            if cand.lower() in c_l:
+    for c_l, c in pairs:
+        for cand_l in cands:
+            if cand_l in c_l:
                 return c
     return None
 
+def _arrow_str(series: pd.Series) -> pa.Array:
+    """Column as a plain Arrow string array (decodes categoricals; zero-copy for string[pyarrow])."""
+    return pa.array(series).cast(pa.string())
+
+def _contains(arr: pa.Array, s: str) -> np.ndarray:
+    """Case-insensitive literal substring mask, computed by Arrow's match_substring kernel."""
+    hits = pc.match_substring(arr, s, ignore_case=True)
+    return np.asarray(pc.fill_null(hits, False), dtype=bool)
+
+@lru_cache(maxsize=None)
+def _resolve_columns(cols: Tuple[str, ...]) -> Dict[str, Optional[str]]:
+    """Every COLUMN_CANDIDATES field resolved against one header set, computed once."""
+    return {key: _find_col_cached(cols, tuple(cands)) for key, cands in COLUMN_CANDIDATES.items()}
+
 def _status_badge(value: str) -> str:
-    v = (value or "").strip().upper()
-    if v in {"APPROVED", "APPROVE", "A"}:
-        return "✅ **APPROVED**"
-    if v in {"PENDING", "IN REVIEW", "REVIEW"}:
-        return "🟡 **PENDING**"
-    if v in {"REJECTED", "REJECT", "DECLINED"}:
-        return "⛔ **REJECTED**"
-    return f"**{value}**" if value else "—"
+    return _STATUS_MAP.get((value or "").strip().upper(), f"**{value}**" if value else "—")
 
 def _normalize_status(value: str) -> str:
     """Map sheet values to one of STATUS_OPTIONS when possible."""
-    v = (value or "").strip().lower()
-    if v in {"approved", "approve", "a"}:
-        return "Approved"
-    if v in {"pending", "in review", "review"}:
-        return "Pending"
-    if v in {"rejected", "reject", "declined"}:
-        return "Rejected"
-    return (value or "").strip()
+    v = (value or "").strip()
+    return _STATUS_SYNONYMS.get(v.upper(), v)
 
+@st.cache_resource(show_spinner=False)
 def _get_gspread_client(write: bool) -> gspread.Client:
     scopes = ["https://www.googleapis.com/auth/spreadsheets"] if write else [
-        "https://www.googleapis.com/auth/spreadsheets.readonly"
+        "https://www.googleapis.com/auth/spreadsheets.readonly",
+        "https://www.googleapis.com/auth/drive.readonly",
     ]
     creds = Credentials.from_service_account_info(
         st.secrets["gcp_service_account"], scopes=scopes
     )
     return gspread.authorize(creds)
 
+@st.cache_resource(show_spinner=False)
+def _get_ws(spreadsheet_id: str, worksheet_name: str, write: bool) -> Tuple[gspread.Spreadsheet, gspread.Worksheet]:
+    """Opened (spreadsheet, worksheet) pair, shared across reruns and sessions."""
+    sh = _get_gspread_client(write).open_by_key(spreadsheet_id)
+    return sh, sh.worksheet(worksheet_name)
+
+def _row_labels(frame: pd.DataFrame, cols: List[str]) -> pd.Series:
+    """'Row <n> | <col1> | <col2> ...' per row, built column-wise."""
+    labels = "Row " + frame["_rownum"].astype(str)
+    for c in cols:
+        labels = labels + " | " + frame[c].astype("string[pyarrow]").fillna("")
+    return labels
+
+def _row_values(frame: pd.DataFrame, rownum: int, headers: List[str]) -> Optional[dict]:
+    """Header -> value of sheet row `rownum`, or None if the frame has no such row."""
+    pos = rownum - 2  # _rownum is position + 2
+    if not 0 <= pos < len(frame):
+        return None
+    rr = frame.iloc[pos]
+    return {h: rr.get(h, "") for h in headers}
+
 def _colnum_to_a1(col_num_1_based: int) -> str:
     """1 -> A, 26 -> Z, 27 -> AA ..."""
     s = ""
@@ -74,39 +156,194 @@ def _colnum_to_a1(col_num_1_based: int) -> str:
         s = chr(65 + r) + s
     return s
 
+# Column letters precomputed for the write path: _A1[0] == "A", _A1[26] == "AA"
+_A1 = [_colnum_to_a1(i) for i in range(1, 1024)]
+
+def _last_col_a1(n_cols: int) -> str:
+    """Letter of the n-th column; computed for sheets wider than the table."""
+    return _A1[n_cols - 1] if n_cols <= len(_A1) else _colnum_to_a1(n_cols)
+
 @st.cache_data(ttl=60, show_spinner=False)
-def load_sheet(spreadsheet_id: str, worksheet_name: str) -> Tuple[pd.DataFrame, List[str]]:
+def sheet_revision(spreadsheet_id: str, worksheet_name: str) -> str:
     """
+    Cheap staleness token for load_sheet: the spreadsheet's Drive modifiedTime.
+    Falls back to a per-minute bucket if Drive metadata can't be read.
+    """
+    sh, _ = _get_ws(spreadsheet_id, worksheet_name, write=False)
+    try:
+        return sh.get_lastUpdateTime()
+    except gspread.exceptions.APIError:
+        return f"t{int(time.time() // 60)}"
+
+def _read_grid(sh: gspread.Spreadsheet, ws: gspread.Worksheet) -> pd.DataFrame:
+    """All cells of the worksheet (header row included) as a string frame."""
+    # ws comes from the process-wide handle cache, so its index may be stale
+    # after tabs were reordered; look it up fresh on every load
+    props = next(
+        (sheet["properties"] for sheet in sh.fetch_sheet_metadata().get("sheets", [])
+         if sheet["properties"].get("sheetId") == ws.id),
+        {},
+    )
+    if props.get("index", ws.index) == 0:
+        # Drive CSV export only covers the first worksheet, but it is a far
+        # smaller payload than JSON and goes straight through pandas' C parser
+        try:
+            raw = sh.export(format=gspread.utils.ExportFormat.CSV)
+        except gspread.exceptions.APIError:
+            raw = None  # e.g. no Drive access: fall back to values.get
+        if raw is not None:
+            if not raw.strip():
+                return pd.DataFrame()
+            return pd.read_csv(io.BytesIO(raw), header=None, dtype="string[pyarrow]", keep_default_na=False)
+
+    # One values.get of the displayed (formatted) values, as the CSV export
+    # and the previous get_all_values() return them
+    resp = sh.values_get(
+        gspread.utils.absolute_range_name(props.get("title", ws.title)),
+        params={"majorDimension": "ROWS"},
+    )
+    values = resp.get("values", [])
+    if not values:
+        return pd.DataFrame()
+
+    # The API drops trailing empty cells; pandas pads the ragged rows with NA
+    return pd.DataFrame(values).astype("string[pyarrow]").fillna("")
+
+def _snapshot_path(spreadsheet_id: str, worksheet_name: str) -> Optional[str]:
+    """
+    Snapshot file for one worksheet, or None when CACHE_DIR is not private
+    to this user; a snapshot anyone else can write must never be served.
+    """
+    try:
+        os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+        st_dir = os.lstat(CACHE_DIR)
+    except OSError:
+        return None
+    # lstat: a symlink is not a directory here
+    if not stat.S_ISDIR(st_dir.st_mode):
+        return None
+    if hasattr(os, "getuid") and (st_dir.st_uid != os.getuid() or st_dir.st_mode & 0o077):
+        return None
+    # Hashed, so names like "Sheet 1" and "Sheet_1" never share a file
+    key = hashlib.sha256(json.dumps([spreadsheet_id, worksheet_name]).encode()).hexdigest()
+    return os.path.join(CACHE_DIR, f"sheet_cache_{key}.parquet")
+
+def _write_snapshot(spreadsheet_id: str, worksheet_name: str, revision: str, load_id: str,
+                    df: pd.DataFrame, headers: List[str], charterers: List[str]) -> None:
+    """Persist a load to local Parquet so a restarted worker can render before the first fetch."""
+    path = _snapshot_path(spreadsheet_id, worksheet_name)
+    if path is None:
+        return
+    tmp_path = None
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        meta = {"spreadsheet_id": spreadsheet_id, "worksheet_name": worksheet_name, "revision": revision,
+                "load_id": load_id, "headers": headers, "charterers": charterers}
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"sheet_cache": json.dumps(meta)})
+        # Unique temp file (mode 0600) next to the target, so concurrent loaders never interleave
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pq.write_table(table, f, compression="zstd")
+        os.replace(tmp_path, path)
+    except Exception:
+        # best effort: without a snapshot the next cold start just fetches
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _read_snapshot(spreadsheet_id: str, worksheet_name: str, revision: str) -> Optional[Tuple[pd.DataFrame, List[str], List[str], str]]:
+    """(df, headers, charterers, load_id) from the local snapshot of this exact revision, or None."""
+    path = _snapshot_path(spreadsheet_id, worksheet_name)
+    if path is None:
+        return None
+    try:
+        # Check the footer metadata before paying for the data pages
+        meta = json.loads(pq.read_schema(path).metadata[b"sheet_cache"])
+        if (meta["spreadsheet_id"], meta["worksheet_name"], meta["revision"]) != (spreadsheet_id, worksheet_name, revision):
+            return None
+        load_id = meta["load_id"]
+        table = pq.read_table(path)
+    except Exception:
+        return None
+    arrow_str = pd.StringDtype("pyarrow")
+    df = table.to_pandas(types_mapper={pa.string(): arrow_str, pa.large_string(): arrow_str}.get)
+    return df, meta["headers"], meta["charterers"], load_id
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_sheet(spreadsheet_id: str, worksheet_name: str, revision: str) -> Tuple[pd.DataFrame, List[str], List[str], str]:
+    """
+    Cached as a shared resource (no per-rerun copy): callers must treat the
+    returned objects as read-only. `revision` (see sheet_revision) is only
+    part of the cache key, so a changed sheet gets reloaded; an unchanged one
+    is served from the local Parquet snapshot when that matches the revision.
+
     Returns:
       df: DataFrame of sheet contents with an extra '_rownum' column for editing
       headers: list of header names in sheet order
+      charterers: unique non-empty charterer names, sorted case-insensitively
+      load_id: unique id of this load's contents; the key for everything derived from df
     """
-    gc = _get_gspread_client(write=False)
-    sh = gc.open_by_key(spreadsheet_id)
-    ws = sh.worksheet(worksheet_name)
+    # Sheet unchanged since the local snapshot was written: skip the download
+    snapshot = _read_snapshot(spreadsheet_id, worksheet_name, revision)
+    if snapshot is not None:
+        return snapshot
+
+    # The revision is no content key (per-minute fallback token, lagging
+    # modifiedTime), so derived caches are keyed on this id instead
+    load_id = f"{revision}:{uuid.uuid4().hex}"
+
+    sh, ws = _get_ws(spreadsheet_id, worksheet_name, write=False)
 
-    values = ws.get_all_values()
-    if not values or len(values) < 2:
-        return pd.DataFrame(), []
+    grid = _read_grid(sh, ws)
+    if len(grid) < 2:
+        return pd.DataFrame(), [], [], load_id
 
-    headers = [h.strip() for h in values[0]]
-    rows = values[1:]  # data rows
+    headers = [str(h).strip() for h in grid.iloc[0].tolist()]
+    df = grid.iloc[1:].reset_index(drop=True)  # data rows
+    df.columns = headers
 
-    df = pd.DataFrame(rows, columns=headers)
+    # Clean up (vectorized per column, same rules as _clean_cell; positional, so
+    # duplicate header names are cleaned too)
+    df = df.apply(lambda col: col.fillna("").str.replace(r"[ \t]+", " ", regex=True).str.strip())
 
-    # Clean up
-    for c in df.columns:
-        df[c] = df[c].map(_clean_cell).astype("string")
+    cols = _resolve_columns(tuple(df.columns))
+
+    # Selector options, sorted once per load instead of per rerun
+    col_ch = cols["charterer"]
+    charterers = sorted(dict.fromkeys(v for v in df[col_ch].tolist() if v), key=str.casefold) if col_ch else []
+
+    # Low-cardinality status/rating columns as categoricals (int codes, one copy per value)
+    for key in CATEGORICAL_FIELDS:
+        c = cols[key]
+        if c and df[c].nunique() * 2 <= len(df):
+            df[c] = df[c].astype("category")
 
     # Add actual sheet row number (header is row 1, first data row is row 2)
     df["_rownum"] = [i + 2 for i in range(len(df))]
 
-    return df, headers
+    _write_snapshot(spreadsheet_id, worksheet_name, revision, load_id, df, headers, charterers)
+    return df, headers, charterers, load_id
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def search_column(load_id: str, _df: pd.DataFrame, col: str) -> pa.Array:
+    """One column as an Arrow string array, converted once per load for searching."""
+    return _arrow_str(_df[col])
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def search_columns(load_id: str, _df: pd.DataFrame, n_cols: int) -> List[pa.Array]:
+    """
+    The first n_cols columns as Arrow string arrays for the full-row search.
+    Built on the first fallback search for a load and reused by later
+    keystrokes; string[pyarrow] columns are shared, not copied.
+    """
+    return [_arrow_str(_df.iloc[:, i]) for i in range(n_cols)]
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def charterer_rows(load_id: str, _df: pd.DataFrame, col: str) -> Dict[str, np.ndarray]:
+    """Charterer value -> positional row indices, built once per load."""
+    return _df.groupby(col, sort=False).indices
 
 def append_row(spreadsheet_id: str, worksheet_name: str, headers: List[str], row_dict: dict) -> None:
-    gc = _get_gspread_client(write=True)
-    sh = gc.open_by_key(spreadsheet_id)
-    ws = sh.worksheet(worksheet_name)
+    _, ws = _get_ws(spreadsheet_id, worksheet_name, write=True)
 
     new_row = [_clean_cell(row_dict.get(h, "")) for h in headers]
     ws.append_row(new_row, value_input_option="USER_ENTERED")
@@ -115,14 +352,112 @@ def update_row(spreadsheet_id: str, worksheet_name: str, headers: List[str], row
     """
     Updates a full row (all columns) at sheet row number = rownum.
     """
-    gc = _get_gspread_client(write=True)
-    sh = gc.open_by_key(spreadsheet_id)
-    ws = sh.worksheet(worksheet_name)
+    _, ws = _get_ws(spreadsheet_id, worksheet_name, write=True)
 
     row_values = [_clean_cell(row_dict.get(h, "")) for h in headers]
-    last_col_letter = _colnum_to_a1(len(headers))
+    last_col_letter = _last_col_a1(len(headers))
     rng = f"A{rownum}:{last_col_letter}{rownum}"
-    ws.update(rng, [row_values], value_input_option="USER_ENTERED")
+    ws.update(values=[row_values], range_name=rng, value_input_option="USER_ENTERED")
+
+def update_rows(spreadsheet_id: str, worksheet_name: str, headers: List[str], rows: Dict[int, dict]) -> None:
+    """
+    Updates several full rows (rownum -> row_dict) in one values.batchUpdate request.
+    """
+    sh, _ = _get_ws(spreadsheet_id, worksheet_name, write=True)
+
+    last_col_letter = _last_col_a1(len(headers))
+    data = []
+    for rownum, row_dict in sorted(rows.items()):
+        rng = gspread.utils.absolute_range_name(worksheet_name, f"A{rownum}:{last_col_letter}{rownum}")
+        data.append({"range": rng, "values": [[_clean_cell(row_dict.get(h, "")) for h in headers]]})
+    sh.values_batch_update(body={"valueInputOption": "USER_ENTERED", "data": data})
+
+@st.cache_resource(show_spinner=False)
+def _executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=2)
+
+def _fetch_sheet(spreadsheet_id: str, worksheet_name: str, revision: str) -> Tuple[str, pd.DataFrame, List[str], List[str]]:
+    df, headers, charterers, load_id = load_sheet(spreadsheet_id, worksheet_name, revision)
+    return load_id, df, headers, charterers
+
+def _run_with_ctx(ctx, fn, *args):
+    # load_sheet is an st cache; without the session's context attached to
+    # the pool thread Streamlit warns about a missing ScriptRunContext
+    add_script_run_ctx(threading.current_thread(), ctx)
+    return fn(*args)
+
+def load_sheet_background(spreadsheet_id: str, worksheet_name: str) -> Tuple[str, pd.DataFrame, List[str], List[str]]:
+    """
+    Returns this session's last loaded (load_id, df, headers, charterers) and
+    refreshes it on a worker thread, so reruns never block on the network once
+    something is loaded. A new session loads synchronously; load_sheet serves
+    the local Parquet snapshot only when its revision is still current.
+
+    The revision is checked here on the script thread (cached for a minute),
+    and a refresh job is only submitted when it differs from the loaded one.
+    A failed revision check or refresh is logged, recorded in
+    session_state["sheet_refresh_failed"] and retried after a minute, while
+    the last good load keeps being served; session_state["df_loaded"] holds
+    (revision, load time) of the data being served.
+    """
+    pending = st.session_state.pop("sheet_future", None)
+    if pending is not None and not pending[1].done():
+        st.session_state["sheet_future"] = pending
+    elif pending is not None:
+        fut_revision, fut = pending
+        try:
+            st.session_state["df_cache"] = fut.result()
+            st.session_state["df_loaded"] = (fut_revision, time.time())
+            st.session_state.pop("sheet_refresh_failed", None)
+        except Exception:
+            # keep serving the last good load
+            logger.exception("Background refresh of %s/%s failed", spreadsheet_id, worksheet_name)
+            st.session_state["sheet_refresh_failed"] = time.time()
+
+    if "df_cache" not in st.session_state:
+        # Nothing to serve yet, so a failure here is the page's error
+        revision = sheet_revision(spreadsheet_id, worksheet_name)
+        st.session_state["df_cache"] = _fetch_sheet(spreadsheet_id, worksheet_name, revision)
+        st.session_state["df_loaded"] = (revision, time.time())
+        return st.session_state["df_cache"]
+
+    if "sheet_future" in st.session_state or time.time() - st.session_state.get("sheet_refresh_failed", 0) < 60:
+        return st.session_state["df_cache"]
+
+    try:
+        revision = sheet_revision(spreadsheet_id, worksheet_name)
+    except Exception:
+        # e.g. a dropped connection: not worth failing the rerun over
+        logger.exception("Revision check of %s/%s failed", spreadsheet_id, worksheet_name)
+        st.session_state["sheet_refresh_failed"] = time.time()
+        return st.session_state["df_cache"]
+
+    if revision == st.session_state["df_loaded"][0]:
+        st.session_state.pop("sheet_refresh_failed", None)
+    else:
+        job = _executor().submit(_run_with_ctx, get_script_run_ctx(), _fetch_sheet,
+                                 spreadsheet_id, worksheet_name, revision)
+        st.session_state["sheet_future"] = (revision, job)
+    return st.session_state["df_cache"]
+
+def invalidate_sheet(spreadsheet_id: str, worksheet_name: str) -> None:
+    """Drop every cached copy of the sheet so the next run refetches it."""
+    st.cache_data.clear()
+    load_sheet.clear()
+    search_column.clear()
+    search_columns.clear()
+    charterer_rows.clear()
+    st.session_state.pop("df_cache", None)
+    st.session_state.pop("sheet_future", None)
+    st.session_state.pop("sheet_refresh_failed", None)
+    st.session_state.pop("search_mask", None)
+    st.session_state.pop("edit_label_map", None)
+    path = _snapshot_path(spreadsheet_id, worksheet_name)
+    try:
+        if path is not None:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
 
 def is_admin_unlocked() -> bool:
     return bool(st.session_state.get("admin_ok", False))
@@ -143,26 +478,30 @@ def admin_login_ui():
 # -----------------------------
 # Load data
 # -----------------------------
-df, headers = load_sheet(SPREADSHEET_ID, WORKSHEET_NAME)
+load_id, df, headers, charterers = load_sheet_background(SPREADSHEET_ID, WORKSHEET_NAME)
+if "sheet_refresh_failed" in st.session_state:
+    age_min = int((time.time() - st.session_state["df_loaded"][1]) // 60)
+    st.warning(f"Could not refresh from Google Sheets; showing data loaded {age_min} min ago.")
 if df.empty:
     st.error("Google Sheet is empty or could not be read.")
     st.stop()
 
-# Column mapping
-col_status    = _find_col(df, ["Status"])
-col_charterer = _find_col(df, ["Charterer"])
-col_company   = _find_col(df, ["Company"])
-col_owner     = _find_col(df, ["Parent Company/Ownership", "Ownership", "Parent Company"])
-col_address   = _find_col(df, ["Address"])
+# Column mapping (resolved once per header set)
+COLS = _resolve_columns(tuple(df.columns))
+col_status    = COLS["status"]
+col_charterer = COLS["charterer"]
+col_company   = COLS["company"]
+col_owner     = COLS["owner"]
+col_address   = COLS["address"]
 
 # Detail-only fields
-col_pool      = _find_col(df, ["Pool Agreement"])
-col_sp        = _find_col(df, ["S&P", "S&P Rating", "S&P rating"])
-col_moodys    = _find_col(df, ["Moody", "Moody's", "Moody's Rating"])
-col_infospec  = _find_col(df, ["InfoSpectrum", "Info Spectrum", "Infospectrum Rating"])
-col_dynamar   = _find_col(df, ["Dynamar", "Dynamar Rating"])
-col_sanctions = _find_col(df, ["Sanctions Check", "Sanction Check", "Sanctions"])
-col_comments  = _find_col(df, ["Comment", "Comments"])
+col_pool      = COLS["pool"]
+col_sp        = COLS["sp"]
+col_moodys    = COLS["moodys"]
+col_infospec  = COLS["infospec"]
+col_dynamar   = COLS["dynamar"]
+col_sanctions = COLS["sanctions"]
+col_comments  = COLS["comments"]
 
 # Validate must-have columns
 required_missing = []
@@ -180,6 +519,21 @@ if required_missing:
     st.error("Missing required columns in the Google Sheet: " + ", ".join(required_missing))
     st.stop()
 
+# Admin form layout after Status: (column, multiline) in display order, built once per header set
+form_key = (tuple(headers), col_status, col_charterer, col_company, col_owner, col_address)
+form_cache = st.session_state.get("form_fields")
+if not form_cache or form_cache[0] != form_key:
+    priority = [c for c in [col_charterer, col_company, col_owner, col_address] if c in headers]
+    handled = set([col_status] + priority)
+    fields = [(c, c == col_address) for c in priority] + [
+        (c, any(k in c.lower() for k in ["address", "comment", "remarks", "notes", "pool"]))
+        for c in headers
+        if c not in handled
+    ]
+    form_cache = (form_key, fields)
+    st.session_state["form_fields"] = form_cache
+form_fields = form_cache[1]
+
 # -----------------------------
 # UI: Search
 # -----------------------------
@@ -192,29 +546,36 @@ with c1:
 with c2:
     show_only = st.checkbox("Only show matches", value=True)
 
-df_work = df.copy()
-
-# Search: prefer charterer matches; else full-row search
-if search_text.strip():
-    s = search_text.strip().lower()
-    charterer_series = df_work[col_charterer].astype("string").fillna("")
-    m_charterer = charterer_series.str.lower().str.contains(re.escape(s), na=False)
+df_work = df  # read-only; only copy where a mutation follows
 
-    if m_charterer.any():
-        df_filtered = df_work[m_charterer].copy()
-    else:
-        joined = df_work.astype("string").fillna("").agg(" | ".join, axis=1).str.lower()
-        df_filtered = df_work[joined.str.contains(re.escape(s), na=False)].copy()
+# Search: prefer charterer matches; else full-row search. Nothing is filtered
+# when "Only show matches" is off. The mask is reused across reruns that don't
+# change the query (selectbox clicks, admin edits...)
+s = search_text.strip()
+search_key = (load_id, s, show_only)
+last_search = st.session_state.get("search_mask")
+if last_search and last_search[0] == search_key:
+    mask = last_search[1]
 else:
-    df_filtered = df_work.copy()
-
-if not show_only and search_text.strip():
-    df_filtered = df_work.copy()
+    mask = slice(None)
+    if s and show_only:
+        m_charterer = _contains(search_column(load_id, df_work, col_charterer), s)
 
-# Selector (Charterer)
-options = df_filtered[col_charterer].dropna().astype("string")
-options = options[options.str.len() > 0]
-options_unique = sorted(options.unique().tolist(), key=lambda x: x.lower())
+        if m_charterer.any():
+            mask = m_charterer
+        else:
+            # Full-row search: OR the per-column hits instead of scanning joined row text
+            mask = np.zeros(len(df_work), dtype=bool)
+            for arr in search_columns(load_id, df_work, len(headers)):
+                mask |= _contains(arr, s)
+    st.session_state["search_mask"] = (search_key, mask)
+
+# Selector (Charterer); only the one column is sliced by the mask
+if isinstance(mask, slice):
+    options_unique = charterers
+else:
+    present = set(df_work.loc[mask, col_charterer].tolist())
+    options_unique = [v for v in charterers if v in present]
 
 selected = st.selectbox("Select charterer / counterparty", ["(select)"] + options_unique)
 
@@ -222,17 +583,14 @@ selected = st.selectbox("Select charterer / counterparty", ["(select)"] + option
 # Details view
 # -----------------------------
 if selected != "(select)":
-    matches = df_work[df_work[col_charterer].astype("string") == selected].copy()
+    pos = charterer_rows(load_id, df_work, col_charterer).get(selected, [])
+    matches = df_work.iloc[pos]
 
     # If duplicates exist, let user select which row
     if len(matches) > 1:
         st.info(f"Found {len(matches)} matching rows for this charterer (duplicates). Select the correct one:")
-        match_labels = []
-        for _, rr in matches.iterrows():
-            label = f"Row {rr['_rownum']} | {rr.get(col_company, '')} | {rr.get(col_status, '')}"
-            match_labels.append(label)
-        pick = st.selectbox("Pick record", match_labels)
-        picked_rownum = int(pick.split("|")[0].replace("Row", "").strip())
+        match_labels = dict(zip(matches["_rownum"].tolist(), _row_labels(matches, [col_company, col_status]).tolist()))
+        picked_rownum = st.selectbox("Pick record", list(match_labels), format_func=match_labels.get)
         row = matches[matches["_rownum"] == picked_rownum].head(1)
     else:
         row = matches.head(1)
@@ -241,6 +599,7 @@ if selected != "(select)":
         st.warning("No exact match found. Try searching again.")
     else:
         r = row.iloc[0]
+        details = {k: r.get(c, "—") for k, c in COLS.items() if c}
 
         t1, t2, t3 = st.columns([1.1, 1.4, 1.5])
 
@@ -254,9 +613,11 @@ if selected != "(select)":
 
         with t2:
             st.subheader("Counterparty")
-            st.write(f"**Charterer:** {r.get(col_charterer, '—')}")
-            st.write(f"**Company:** {r.get(col_company, '—')}")
-            st.write(f"**Parent company / ownership:** {r.get(col_owner, '—')}")
+            st.markdown(
+                f"**Charterer:** {details.get('charterer', '—')}  \n"
+                f"**Company:** {details.get('company', '—')}  \n"
+                f"**Parent company / ownership:** {details.get('owner', '—')}"
+            )
 
             st.subheader("Address")
             st.code(r.get(col_address, "—") or "—", language="text")
@@ -269,10 +630,12 @@ if selected != "(select)":
 
         with t3:
             st.subheader("Ratings")
-            st.write(f"**S&P:** {r.get(col_sp, '—') if col_sp else '—'}")
-            st.write(f"**Moody's:** {r.get(col_moodys, '—') if col_moodys else '—'}")
-            st.write(f"**InfoSpectrum:** {r.get(col_infospec, '—') if col_infospec else '—'}")
-            st.write(f"**Dynamar:** {r.get(col_dynamar, '—') if col_dynamar else '—'}")
+            st.markdown(
+                f"**S&P:** {details.get('sp', '—')}  \n"
+                f"**Moody's:** {details.get('moodys', '—')}  \n"
+                f"**InfoSpectrum:** {details.get('infospec', '—')}  \n"
+                f"**Dynamar:** {details.get('dynamar', '—')}"
+            )
 
         st.divider()
         st.subheader("Comments")
@@ -287,8 +650,10 @@ if selected != "(select)":
 # -----------------------------
 st.subheader("All / Filtered counterparties")
 table_cols = [col_status, col_charterer, col_company, col_owner, col_address]
-table_cols = [c for c in table_cols if c and c in df_filtered.columns]
-st.dataframe(df_filtered[table_cols], use_container_width=True, hide_index=True)
+table_cols = [c for c in table_cols if c and c in df_work.columns]
+# Handed over as an Arrow table: the string[pyarrow] columns convert without copying
+table = pa.Table.from_pandas(df_work.loc[mask, table_cols], preserve_index=False)
+st.dataframe(table, use_container_width=True, hide_index=True)
 
 # -----------------------------
 # Admin: Add + Edit (password protected)
@@ -313,24 +678,10 @@ with st.expander("🔒 Admin: Add / Edit counterparties", expanded=False):
             current_status = ""
             new_data[col_status] = st.selectbox("Status", STATUS_OPTIONS, index=0)
 
-            # Priority fields
-            priority = [col_charterer, col_company, col_owner, col_address]
-            for c in priority:
-                if c and c in headers:
-                    if c == col_address:
-                        new_data[c] = st.text_area(c, value="")
-                    else:
-                        new_data[c] = st.text_input(c, value="")
-
-            # Remaining columns (exclude those already handled)
-            handled = set([col_status] + priority)
-            for c in headers:
-                if c in handled:
-                    continue
-                if any(k in c.lower() for k in ["address", "comment", "remarks", "notes", "pool"]):
-                    new_data[c] = st.text_area(c, value="")
-                else:
-                    new_data[c] = st.text_input(c, value="")
+            # Priority fields, then remaining columns
+            for c, multiline in form_fields:
+                widget = st.text_area if multiline else st.text_input
+                new_data[c] = widget(c, value="")
 
             submitted = st.form_submit_button("Add to Google Sheet")
 
@@ -341,7 +692,7 @@ with st.expander("🔒 Admin: Add / Edit counterparties", expanded=False):
                     try:
                         append_row(SPREADSHEET_ID, WORKSHEET_NAME, headers=headers, row_dict=new_data)
                         st.success("Added successfully. Refreshing…")
-                        st.cache_data.clear()
+                        invalidate_sheet(SPREADSHEET_ID, WORKSHEET_NAME)
                         st.rerun()
                     except Exception as e:
                         st.error(f"Failed to append row. Error: {e}")
@@ -350,25 +701,34 @@ with st.expander("🔒 Admin: Add / Edit counterparties", expanded=False):
     with tab_edit:
         st.caption("Edits an existing row in-place (updates the full row).")
 
-        # Choose record to edit (handles duplicates)
-        df_edit = df_work.copy()
-        df_edit["_label"] = (
-            "Row " + df_edit["_rownum"].astype(str)
-            + " | " + df_edit[col_charterer].astype("string")
-            + " | " + df_edit[col_company].astype("string")
-            + " | " + df_edit[col_status].astype("string")
+        # Choose record to edit (handles duplicates); labels built once per load
+        label_cache = st.session_state.get("edit_label_map")
+        if not label_cache or label_cache[0] != load_id:
+            labels = _row_labels(df_work, [col_charterer, col_company, col_status])
+            label_cache = (load_id, dict(zip(df_work["_rownum"].tolist(), labels.tolist())))
+            st.session_state["edit_label_map"] = label_cache
+        label_map = label_cache[1]
+        rownum = st.selectbox(
+            "Select record to edit",
+            ["(select)"] + list(label_map),
+            format_func=lambda x: x if x == "(select)" else label_map[x],
         )
-        labels = df_edit["_label"].tolist()
-        selected_label = st.selectbox("Select record to edit", ["(select)"] + labels)
 
-        if selected_label != "(select)":
-            rownum = int(selected_label.split("|")[0].replace("Row", "").strip())
-            rec = df_edit[df_edit["_rownum"] == rownum].head(1)
+        if rownum != "(select)":
+            # _rownum is position + 2, so the record is a direct positional lookup
+            pos = rownum - 2
+            rec = df_work.iloc[[pos]] if 0 <= pos < len(df_work) else df_work.iloc[[]]
             if rec.empty:
                 st.error("Could not load the selected record.")
             else:
                 rr = rec.iloc[0]
                 existing = {h: rr.get(h, "") for h in headers}
+                original = dict(existing)
+                queued = st.session_state.get("pending_updates", {}).get(rownum)
+                if queued and queued[0] == original:
+                    # Continue from the queued values rather than the sheet's
+                    existing.update(queued[1])
+                    st.caption("Showing this row's queued change.")
 
                 with st.form("edit_counterparty_form", clear_on_submit=False):
                     edited = {}
@@ -381,35 +741,59 @@ with st.expander("🔒 Admin: Add / Edit counterparties", expanded=False):
                         idx = 0
                     edited[col_status] = st.selectbox("Status", STATUS_OPTIONS, index=idx)
 
-                    # Priority fields
-                    for c in [col_charterer, col_company, col_owner, col_address]:
-                        if c and c in headers:
-                            if c == col_address:
-                                edited[c] = st.text_area(c, value=existing.get(c, ""))
-                            else:
-                                edited[c] = st.text_input(c, value=existing.get(c, ""))
-
-                    # Remaining columns
-                    handled = set([col_status, col_charterer, col_company, col_owner, col_address])
-                    for c in headers:
-                        if c in handled:
-                            continue
-                        if any(k in c.lower() for k in ["address", "comment", "remarks", "notes", "pool"]):
-                            edited[c] = st.text_area(c, value=existing.get(c, ""))
-                        else:
-                            edited[c] = st.text_input(c, value=existing.get(c, ""))
-
-                    colA, colB = st.columns([1, 2])
+                    # Priority fields, then remaining columns
+                    for c, multiline in form_fields:
+                        widget = st.text_area if multiline else st.text_input
+                        edited[c] = widget(c, value=existing.get(c, ""))
+
+                    colA, colB, colC = st.columns([1, 1, 2])
                     with colA:
                         save = st.form_submit_button("Save changes")
                     with colB:
+                        queue = st.form_submit_button("Queue change")
+                    with colC:
                         st.caption("Saving overwrites the entire row in Google Sheets for this record.")
 
+                    if queue:
+                        # Remember the row as it was edited; if the sheet's row changes
+                        # before the flush, writing it would overwrite someone else's change
+                        st.session_state.setdefault("pending_updates", {})[rownum] = (original, edited)
+                        st.info(f"Row {rownum} queued. Use 'Flush changes' to write all queued rows at once.")
+
                     if save:
+                        st.session_state.get("pending_updates", {}).pop(rownum, None)
                         try:
                             update_row(SPREADSHEET_ID, WORKSHEET_NAME, headers=headers, rownum=rownum, row_dict=edited)
                             st.success("Updated successfully. Refreshing…")
-                            st.cache_data.clear()
+                            invalidate_sheet(SPREADSHEET_ID, WORKSHEET_NAME)
                             st.rerun()
                         except Exception as e:
                             st.error(f"Failed to update row. Error: {e}")
+
+        # Queued edits: written together in one batch request
+        pending = st.session_state.get("pending_updates", {})
+        if pending:
+            st.caption(f"{len(pending)} queued change(s): rows " + ", ".join(str(n) for n in sorted(pending)))
+            changed = sorted(n for n, (original, _) in pending.items()
+                             if _row_values(df_work, n, headers) != original)
+            if changed:
+                st.warning(
+                    "These rows changed in the sheet after they were queued and are not flushed: "
+                    + ", ".join(str(n) for n in changed)
+                    + ". Drop them and re-apply the edits against the current data."
+                )
+                if st.button("Drop changed rows"):
+                    for n in changed:
+                        pending.pop(n)
+                    st.rerun()
+            to_flush = {n: row for n, (_, row) in pending.items() if n not in changed}
+            if to_flush and st.button("Flush changes"):
+                try:
+                    update_rows(SPREADSHEET_ID, WORKSHEET_NAME, headers=headers, rows=to_flush)
+                    for n in to_flush:
+                        pending.pop(n)
+                    st.success("Queued changes saved. Refreshing…")
+                    invalidate_sheet(SPREADSHEET_ID, WORKSHEET_NAME)
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Failed to write queued changes. Error: {e}")